@@ -1,8 +1,9 @@
 import os
+import threading
 from googleapiclient.discovery import build
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.oauth2.credentials import Credentials
-from google.auth.transport.requests import Request
+from google.auth.transport.requests import Request, AuthorizedSession
 from googleapiclient.http import MediaIoBaseDownload
 from io import BytesIO
 
@@ -10,25 +11,40 @@ SCOPES = ["https://www.googleapis.com/auth/drive.readonly"]
 TOKEN_PATH = "config/token.json"
 CREDS_PATH = "config/gdrive_credentials.json"
 
-def get_gdrive_service():
-    creds = None
+GOOGLE_SHEET_MIME = "application/vnd.google-apps.spreadsheet"
+CSV_MIME = "text/csv"
+XLSX_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+# the spreadsheet export URL has no 10 MB cap, unlike Drive's files.export;
+# without a gid it returns the first sheet
+SHEET_EXPORT_URL = "https://docs.google.com/spreadsheets/d/{file_id}/export?format=csv&gid={gid}"
+FIRST_SHEET_EXPORT_URL = "https://docs.google.com/spreadsheets/d/{file_id}/export?format=csv"
+
+# reference downloads run in parallel threads; only one may refresh/write the token
+_creds_lock = threading.Lock()
+
+def get_gdrive_credentials():
+    with _creds_lock:
+        creds = None
+
+        if os.path.exists(TOKEN_PATH):
+            creds = Credentials.from_authorized_user_file(TOKEN_PATH, SCOPES)
 
-    if os.path.exists(TOKEN_PATH):
-        creds = Credentials.from_authorized_user_file(TOKEN_PATH, SCOPES)
+        if not creds or not creds.valid:
+            if creds and creds.expired and creds.refresh_token:
+                creds.refresh(Request())
+            else:
+                flow = InstalledAppFlow.from_client_secrets_file(
+                    CREDS_PATH, SCOPES
+                )
+                creds = flow.run_local_server(port=0)
 
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file(
-                CREDS_PATH, SCOPES
-            )
-            creds = flow.run_local_server(port=0)
+            with open(TOKEN_PATH, "w") as token:
+                token.write(creds.to_json())
 
-        with open(TOKEN_PATH, "w") as token:
-            token.write(creds.to_json())
+        return creds
 
-    return build("drive", "v3", credentials=creds)
+def get_gdrive_service():
+    return build("drive", "v3", credentials=get_gdrive_credentials())
 
 def download_file_by_id(file_id):
     service = get_gdrive_service()
@@ -41,10 +57,95 @@ def download_file_by_id(file_id):
     fh.seek(0)
     return fh
 
-def list_files_in_folder(folder_id):
+def get_file_metadata(file_id):
     service = get_gdrive_service()
-    results = service.files().list(
-        q=f"'{folder_id}' in parents and trashed = false",
-        fields="files(id, name)"
+    return service.files().get(fileId=file_id, fields="id, name, mimeType").execute()
+
+def fetch_export_url(session, url):
+    response = session.get(url)
+    response.raise_for_status()
+    return BytesIO(response.content)
+
+def export_first_sheet_as_csv(file_id):
+    # Returns the first sheet of a native Google Sheet as CSV
+    session = AuthorizedSession(get_gdrive_credentials())
+    return fetch_export_url(session, FIRST_SHEET_EXPORT_URL.format(file_id=file_id))
+
+def export_file_as_xlsx(file_id):
+    # Drive-only fallback for native Google Sheets (files.export is capped at 10 MB)
+    service = get_gdrive_service()
+    request = service.files().export_media(fileId=file_id, mimeType=XLSX_MIME)
+    fh = BytesIO()
+    downloader = MediaIoBaseDownload(fh, request)
+    done = False
+    while not done:
+        _, done = downloader.next_chunk()
+    fh.seek(0)
+    return fh
+
+def export_sheets_as_csv(file_id):
+    # Returns [(sheet title, CSV BytesIO)] for every sheet of a native Google Sheet.
+    # Listing the sheets needs the Google Sheets API enabled in the GCP project.
+    creds = get_gdrive_credentials()
+    sheets_service = build("sheets", "v4", credentials=creds)
+    spreadsheet = sheets_service.spreadsheets().get(
+        spreadsheetId=file_id,
+        fields="sheets.properties(sheetId,title)"
     ).execute()
-    return results.get("files", [])
+
+    session = AuthorizedSession(creds)
+    exported = []
+    for sheet in spreadsheet.get("sheets", []):
+        props = sheet["properties"]
+        url = SHEET_EXPORT_URL.format(file_id=file_id, gid=props["sheetId"])
+        exported.append((props["title"], fetch_export_url(session, url)))
+    return exported
+
+def list_files_in_folder(folder_id):
+    service = get_gdrive_service()
+    files = []
+    page_token = None
+    while True:
+        results = service.files().list(
+            q=f"'{folder_id}' in parents and trashed = false",
+            fields="nextPageToken, files(id, name, mimeType)",
+            pageSize=1000,
+            pageToken=page_token
+        ).execute()
+        files.extend(results.get("files", []))
+        page_token = results.get("nextPageToken")
+        if not page_token:
+            break
+    return files
+
+def get_changes_start_page_token():
+    service = get_gdrive_service()
+    return service.changes().getStartPageToken().execute()["startPageToken"]
+
+def list_changes(page_token):
+    # Returns (changes, new start page token) for everything changed since page_token
+    service = get_gdrive_service()
+    changes = []
+    while True:
+        results = service.changes().list(
+            pageToken=page_token,
+            spaces="drive",
+            includeRemoved=True,
+            pageSize=1000,
+            fields="nextPageToken, newStartPageToken, changes(fileId, removed, file(id, name, mimeType, parents, trashed))"
+        ).execute()
+        changes.extend(results.get("changes", []))
+        if "newStartPageToken" in results:
+            return changes, results["newStartPageToken"]
+        page_token = results["nextPageToken"]
+
+class DriveChangesFeed:
+    # The Drive calls used by delta sync; a local fake with the same methods can stand in for tests
+    def start_page_token(self):
+        return get_changes_start_page_token()
+
+    def changes(self, page_token):
+        return list_changes(page_token)
+
+    def list_folder(self, folder_id):
+        return list_files_in_folder(folder_id)
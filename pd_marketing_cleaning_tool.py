@@ -12,15 +12,35 @@
 
 import os
 import re
+import time
+import pickle
+import sqlite3
+import tempfile
+import weakref
+import queue
+import threading
+import multiprocessing
 from glob import glob
 from datetime import datetime
+import numpy as np
 import pandas as pd
 from tqdm import tqdm
 from io import StringIO
 from io import BytesIO
 from collections import defaultdict
-from config.gdrive_client import download_file_by_id, list_files_in_folder
-from openpyxl import load_workbook
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from config.gdrive_client import (
+    download_file_by_id,
+    get_file_metadata,
+    export_first_sheet_as_csv,
+    export_sheets_as_csv,
+    export_file_as_xlsx,
+    GOOGLE_SHEET_MIME,
+    CSV_MIME,
+    DriveChangesFeed,
+)
+from openpyxl import Workbook
 from openpyxl.utils import get_column_letter
 from datetime import datetime
 import json
@@ -31,6 +51,9 @@ with open("config/gdrive_files.json", "r") as f:
 with open("config/gdrive_folders.json", "r") as f:
     GDRIVE_FOLDERS = json.load(f)
 
+with open("config/opt_out_rules.json", "r") as f:
+    OPT_OUT_RULES = json.load(f)
+
 # ----------------------- DIRECTORIES -----------------------
 # input folder
 INPUT_FOLDER = "for_processing"
@@ -42,6 +65,37 @@ OUTPUT_CLEANED_FOLDER = "output"
 os.makedirs("output", exist_ok=True)
 os.makedirs(OUTPUT_CLEANED_FOLDER, exist_ok=True)
 
+# ----------------------- OUTPUT LIMITS -----------------------
+# Excel caps a sheet at 1,048,576 rows; smaller shards keep the output quick to open
+MAX_ROWS_PER_SHEET = 250_000
+# once a workbook holds this many data rows, the next shard starts a new workbook
+MAX_ROWS_PER_WORKBOOK = 500_000
+MAX_SHEET_NAME_LENGTH = 31
+OUTPUT_WRITER_WORKERS = max(1, min(4, os.cpu_count() or 1))
+# processes used to parse input sheets ahead of row processing
+INPUT_READER_WORKERS = max(1, min(4, os.cpu_count() or 1))
+
+# ----------------------- REFERENCE CACHE -----------------------
+# pd_phone + opt-out indexes prefetched by the GUI (or the last run) are reused while fresh
+REFERENCE_CACHE_FOLDER = "cache"
+REFERENCE_CACHE_PATH = os.path.join(REFERENCE_CACHE_FOLDER, "reference_data.pkl")
+REFERENCE_MAX_AGE_SECONDS = 30 * 60
+# pd_phone folder index kept in step with the Drive changes feed
+PD_PHONE_SYNC_PATH = os.path.join(REFERENCE_CACHE_FOLDER, "pd_phone_sync.pkl")
+
+# ----------------------- DEDUP LIMITS -----------------------
+# in-run duplicate index entries held in memory before spilling to disk
+DEDUP_MAX_MEMORY_ENTRIES = 5_000_000
+
+# ----------------------- PIPELINE -----------------------
+# input files parsed ahead of row processing
+INPUT_QUEUE_SIZE = 2
+# cleaned sheet shards waiting on each output writer process
+OUTPUT_QUEUE_SIZE = 4
+
+# rows processed between progress updates / cancel checks
+PROGRESS_CHUNK_ROWS = 1000
+
 # ---- COLUMN NORMALIZATION (put near the top of file, or inside main) ----
 COLUMN_ALIASES = {
     # required columns
@@ -85,7 +139,161 @@ PHONE_FIELDS = [
 
 ]
 
+CLEANED_COLUMNS = [
+    "Carrier",
+    "Deal - ID",
+    "Phone Number",
+    "First Name",
+    "Deal - Value",
+    "Deal - Owner",
+    "Deal - County",
+    "Deal - Title",
+    "Deal - Stage",
+    "Remarks"
+]
+
 # ------------------ FUNCTIONS ------------------
+class RunCancelled(Exception):
+    pass
+
+def _drop_spill_file(db, path):
+    db.close()
+    if os.path.exists(path):
+        os.remove(path)
+
+class _SpillFilter:
+    # Bloom filter over one spilled batch of phones (about 10 bits per phone and
+    # 3 hashes, so ~1% false positives). Numbers that were never spilled, which is
+    # most of them, skip the SQLite lookup.
+    MULTIPLIERS = (0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9)
+
+    def __init__(self, phones):
+        size_bits = max(int(len(phones) * 10 - 1).bit_length(), 6)
+        self.shift = 64 - size_bits
+        bits = np.zeros(1 << (size_bits - 3), dtype=np.uint8)
+        keys = phones.astype(np.uint64)
+        for mult in self.MULTIPLIERS:
+            # multiplicative hashing; uint64 arrays wrap on overflow like the & below
+            pos = (keys * np.uint64(mult)) >> np.uint64(self.shift)
+            np.bitwise_or.at(bits, pos >> np.uint64(3), np.left_shift(1, pos & np.uint64(7)).astype(np.uint8))
+        self.bits = bits.tobytes()
+
+    def __contains__(self, phone):
+        for mult in self.MULTIPLIERS:
+            pos = (phone * mult & 0xFFFFFFFFFFFFFFFF) >> self.shift
+            if not self.bits[pos >> 3] >> (pos & 7) & 1:
+                return False
+        return True
+
+class PhoneDedupIndex:
+    # Phone -> first Deal ID seen in this run. Phones and deal codes live in two
+    # sorted int64 arrays (16 bytes per phone) fed by a small dict of recent adds.
+    # Past max_memory_entries the arrays are spilled into an on-disk SQLite B-tree
+    # with a Bloom filter per spill, so disk is only read for likely repeats.
+    MIN_PENDING = 65_536
+
+    def __init__(self, max_memory_entries=DEDUP_MAX_MEMORY_ENTRIES):
+        self.max_memory_entries = max_memory_entries
+        self.pending = {}
+        self.phones = np.empty(0, dtype=np.int64)
+        self.deals = np.empty(0, dtype=np.int64)
+        # Deal IDs are stored as their integer value; any other ID is stored as
+        # -(position + 1) in other_deal_ids
+        self.other_deal_ids = []
+        self._other_codes = {}
+        self.filters = []
+        self.db = None
+        self._finalizer = None
+        self._merge_at = max(1, min(self.MIN_PENDING, max_memory_entries))
+
+    def _deal_code(self, deal_id):
+        try:
+            code = int(deal_id)
+        except (TypeError, ValueError):
+            code = -1
+        # only IDs that round-trip exactly (no leading zeros, signs or spaces)
+        if 0 <= code < 1 << 63 and str(code) == deal_id:
+            return code
+        if deal_id not in self._other_codes:
+            self.other_deal_ids.append(deal_id)
+            self._other_codes[deal_id] = -len(self.other_deal_ids)
+        return self._other_codes[deal_id]
+
+    def _deal_id(self, code):
+        return str(code) if code >= 0 else self.other_deal_ids[-code - 1]
+
+    def first_deal(self, phone):
+        key = int(phone)
+        code = self.pending.get(key)
+        if code is None:
+            phones = self.phones
+            i = phones.searchsorted(key)
+            if i < phones.size and phones[i] == key:
+                code = int(self.deals[i])
+            elif self.db is not None:
+                for spilled in self.filters:
+                    if key in spilled:
+                        found = self.db.execute("SELECT deal_id FROM seen WHERE phone = ?", (key,)).fetchone()
+                        if found:
+                            code = found[0]
+                        break
+        return None if code is None else self._deal_id(code)
+
+    def add(self, phone, deal_id):
+        pending = self.pending
+        pending[int(phone)] = self._deal_code(deal_id)
+        if len(pending) >= self._merge_at:
+            self._merge_pending()
+            if self.phones.size >= self.max_memory_entries:
+                self.spill()
+            # merges grow with the arrays so their O(n) cost stays amortized, but
+            # never let memory go past max_memory_entries
+            room = self.max_memory_entries - self.phones.size
+            self._merge_at = max(1, min(max(self.MIN_PENDING, self.phones.size // 8), room))
+
+    def _merge_pending(self):
+        # sorts only the recent adds and inserts them in one O(n) pass
+        if not self.pending:
+            return
+        count = len(self.pending)
+        phones = np.fromiter(self.pending.keys(), dtype=np.int64, count=count)
+        deals = np.fromiter(self.pending.values(), dtype=np.int64, count=count)
+        order = phones.argsort()
+        at = self.phones.searchsorted(phones[order])
+        self.phones = np.insert(self.phones, at, phones[order])
+        self.deals = np.insert(self.deals, at, deals[order])
+        self.pending.clear()
+
+    def spill(self):
+        self._merge_pending()
+        if not len(self.phones):
+            return
+        if self.db is None:
+            fd, path = tempfile.mkstemp(prefix="pd_mktg_dedup_", suffix=".sqlite")
+            os.close(fd)
+            self.db = sqlite3.connect(path)
+            self.db.execute("PRAGMA journal_mode = OFF")
+            self.db.execute("PRAGMA synchronous = OFF")
+            self.db.execute("CREATE TABLE seen (phone INTEGER PRIMARY KEY, deal_id INTEGER) WITHOUT ROWID")
+            # removes the spill file even if the run stops early
+            self._finalizer = weakref.finalize(self, _drop_spill_file, self.db, path)
+        # keys in memory are never on disk yet, so the INSERTs never conflict; the
+        # arrays are already sorted, which keeps B-tree page writes sequential
+        self.db.executemany("INSERT INTO seen VALUES (?, ?)", zip(self.phones.tolist(), self.deals.tolist()))
+        self.db.commit()
+        self.filters.append(_SpillFilter(self.phones))
+        self.phones = np.empty(0, dtype=np.int64)
+        self.deals = np.empty(0, dtype=np.int64)
+
+    def close(self):
+        self.pending.clear()
+        self.phones = np.empty(0, dtype=np.int64)
+        self.deals = np.empty(0, dtype=np.int64)
+        self.filters = []
+        if self._finalizer is not None:
+            self._finalizer()
+            self.db = None
+
 def check_required_columns(df, file_path):
     required_columns = [
         "Deal - ID",
@@ -113,81 +321,381 @@ def check_required_columns(df, file_path):
 def normalize_phone(number):
     return re.sub(r"[^\d]", "", str(number))
 
-def load_opt_out_phone_numbers(excel_filenames=None):
-    # Default Excel files if none specified
-    if excel_filenames is None:
-        excel_filenames = ["DNC (Cold-PD).xlsx", "CallTextOut-7d (PD).xlsx"]
-    
-    numbers = defaultdict(set)  # phone -> set of filenames
+def compile_opt_out_rules(rules):
+    # Turns stage -> list names into stage -> bitmask, with one bit per opt-out list
+    list_names = []
+    for names in [rules.get("default", [])] + list(rules.get("stages", {}).values()):
+        for name in names:
+            if name not in list_names:
+                list_names.append(name)
+
+    bits = {name: 1 << i for i, name in enumerate(list_names)}
+    default_mask = 0
+    for name in rules.get("default", []):
+        default_mask |= bits[name]
+
+    stage_masks = {}
+    for stage, names in rules.get("stages", {}).items():
+        mask = 0
+        for name in names:
+            mask |= bits[name]
+        stage_masks[stage] = mask
+
+    return list_names, stage_masks, default_mask
+
+def is_csv_source(file):
+    return file.get("mimeType") in (GOOGLE_SHEET_MIME, CSV_MIME) or file["name"].lower().endswith(".csv")
+
+def read_first_column_csv(content):
+    # Only column 0 is parsed, with the C engine, so large lists stay cheap to read
+    try:
+        col = pd.read_csv(content, header=None, usecols=[0], dtype=str,
+                          engine="c", on_bad_lines="skip")[0]
+    except pd.errors.EmptyDataError:
+        return set()
+    return set(col.dropna().map(normalize_phone))
+
+def read_first_column_excel(content):
+    # one read_excel call parses every sheet of the workbook
+    numbers = set()
+    sheets = pd.read_excel(content, sheet_name=None, header=None, dtype=str)
+
+    for df in sheets.values():
+        if df.empty or 0 not in df.columns:
+            continue
+
+        numbers.update(df[0].dropna().astype(str).map(normalize_phone))
+    return numbers
 
-    for name in excel_filenames:
-        clean_name = name.replace(".xlsx", "")
-        file_id = GDRIVE_FILES.get(clean_name)
+def read_opt_out_list(name):
+    # Returns the normalized numbers of one opt-out list (column 0 of every sheet).
+    # Native Google Sheets and CSV files are preferred over full xlsx downloads.
+    # Raises when the list can't be read so the caller can record the failure.
+    clean_name = name.replace(".xlsx", "")
+    file_id = GDRIVE_FILES.get(clean_name)
 
-        if not file_id:
-            print(f"⚠️ Missing GDrive file ID for {name}")
-            continue
+    if not file_id:
+        raise KeyError(f"Missing GDrive file ID for {name}")
 
+    numbers = set()
+    file = get_file_metadata(file_id)
+    if file.get("mimeType") == GOOGLE_SHEET_MIME:
         try:
-            content = download_file_by_id(file_id)
-            xls = pd.ExcelFile(content)
+            for _, content in export_sheets_as_csv(file_id):
+                numbers.update(read_first_column_csv(content))
+        except Exception as e:
+            # e.g. 403 when the Sheets API is not enabled for the project
+            print(f"⚠️ Per-sheet CSV export failed for {name} ({e}); falling back to xlsx export")
+            numbers = read_first_column_excel(export_file_as_xlsx(file_id))
+    elif is_csv_source(file):
+        numbers.update(read_first_column_csv(download_file_by_id(file_id)))
+    else:
+        numbers = read_first_column_excel(download_file_by_id(file_id))
+    return numbers
 
-            for sheet_name in xls.sheet_names:
-                df = pd.read_excel(xls, sheet_name=sheet_name, header=None, dtype=str)
-                if df.empty or 0 not in df.columns:
-                    continue
+PD_PHONE_COLUMNS = {"Deal - ID", "Deal - Stage", *PHONE_FIELDS}
+
+def select_pd_phone_sources(files):
+    # One source per export name, preferring native Sheets, then CSV, then xlsx
+    selected = {}
+    for file in files:
+        name = file["name"]
+        lower = name.lower()
+        if file.get("mimeType") == GOOGLE_SHEET_MIME:
+            base, priority = name, 0
+        elif lower.endswith(".csv"):
+            base, priority = name[:-4], 1
+        elif lower.endswith(".xlsx"):
+            base, priority = name[:-5], 2
+        else:
+            continue
+        if base not in selected or priority < selected[base][0]:
+            selected[base] = (priority, file)
+    return [file for _, file in selected.values()]
+
+def read_pd_phone_file(file):
+    usecols = lambda c: c in PD_PHONE_COLUMNS
+    if file.get("mimeType") == GOOGLE_SHEET_MIME:
+        df = pd.read_csv(export_first_sheet_as_csv(file["id"]), dtype=str, usecols=usecols)
+    elif is_csv_source(file):
+        df = pd.read_csv(download_file_by_id(file["id"]), dtype=str, usecols=usecols)
+    else:
+        df = pd.read_excel(download_file_by_id(file["id"]), engine="openpyxl", dtype=str, usecols=usecols)
+    df.fillna("", inplace=True)
+    return df
 
-                nums = df[0].dropna().astype(str).map(normalize_phone)
-                for num in nums:
-                    numbers[num].add(name)
+def index_pd_phone_frame(df, pd_phone_numbers):
+    for _, row in df.iterrows():
+        deal_id = row.get("Deal - ID", "")
+        deal_stage = row.get("Deal - Stage", "")
 
+        for field in PHONE_FIELDS:
+            raw_phones = str(row.get(field, ""))
+            if not raw_phones.strip():
+                continue
+
+            for phone in map(str.strip, raw_phones.split(",")):
+                normalized = normalize_phone(phone)
+                if len(normalized) == 11 and normalized.startswith("1"):
+                    normalized = normalized[1:]
+                if len(normalized) == 10 and normalized.isdigit():
+                    # Store as list to handle multiple deals
+                    pd_phone_numbers.setdefault(normalized, []).append({
+                        "deal_id": deal_id,
+                        "deal_stage": deal_stage
+                    })
+
+def index_pd_phone_file(file, read_file):
+    file_numbers = {}
+    index_pd_phone_frame(read_file(file), file_numbers)
+    return file_numbers
+
+def full_sync_pd_phone(folder_id, feed, read_file):
+    # Token is taken before listing so nothing changed during the listing is missed
+    state = {
+        "folder_id": folder_id,
+        "page_token": feed.start_page_token(),
+        "files": {},      # file_id -> metadata of every candidate file in the folder
+        "indexed": {},    # file_id -> phone -> [deal entries] for the selected sources
+        "retry": set(),   # selected files that failed to read last time
+    }
+    for file in feed.list_folder(folder_id):
+        state["files"][file["id"]] = {"id": file["id"], "name": file["name"], "mimeType": file.get("mimeType")}
+    refresh_pd_phone_index(state, set(state["files"]), read_file)
+    return state
+
+def refresh_pd_phone_index(state, changed_ids, read_file):
+    # Re-reads only the selected sources that changed; drops files no longer selected
+    selected_files = select_pd_phone_sources(state["files"].values())
+    selected = {file["id"] for file in selected_files}
+
+    for file_id in list(state["indexed"]):
+        if file_id not in selected:
+            del state["indexed"][file_id]
+    state["retry"] &= selected
+
+    for file in selected_files:
+        file_id = file["id"]
+        if file_id in state["indexed"] and file_id not in changed_ids and file_id not in state["retry"]:
+            continue
+        try:
+            state["indexed"][file_id] = index_pd_phone_file(file, read_file)
+            state["retry"].discard(file_id)
         except Exception as e:
-            print(f"Error reading GDrive file {name}: {e}")
-    return numbers
+            print(f"Error reading file {file['name']}: {e}")
+            state["indexed"].pop(file_id, None)
+            state["retry"].add(file_id)
+
+def sync_pd_phone_state(state, folder_id, feed=None, read_file=None):
+    # Applies the Drive changes since the stored page token to the pd_phone index.
+    # feed/read_file can be replaced by local fakes to exercise the sync offline.
+    feed = feed or DriveChangesFeed()
+    read_file = read_file or read_pd_phone_file
+
+    if not state or state.get("folder_id") != folder_id or not state.get("page_token"):
+        return full_sync_pd_phone(folder_id, feed, read_file)
+
+    changes, new_token = feed.changes(state["page_token"])
+    changed_ids = set()
+    for change in changes:
+        file_id = change.get("fileId")
+        file = change.get("file") or {}
+        in_folder = (
+            not change.get("removed")
+            and not file.get("trashed")
+            and folder_id in file.get("parents", [])
+        )
+        if in_folder:
+            state["files"][file_id] = {"id": file_id, "name": file["name"], "mimeType": file.get("mimeType")}
+            changed_ids.add(file_id)
+        elif file_id in state["files"]:
+            # deleted, trashed or moved out of the folder
+            del state["files"][file_id]
+            changed_ids.add(file_id)
+
+    refresh_pd_phone_index(state, changed_ids, read_file)
+    state["page_token"] = new_token
+    return state
+
+def merge_pd_phone_index(state):
+    pd_phone_numbers = {}
+    files = sorted(state["indexed"], key=lambda file_id: state["files"][file_id]["name"])
+    for file_id in files:
+        for phone, entries in state["indexed"][file_id].items():
+            pd_phone_numbers.setdefault(phone, []).extend(entries)
+    return pd_phone_numbers
+
+def load_pd_phone_sync_state():
+    if not os.path.exists(PD_PHONE_SYNC_PATH):
+        return None
+    try:
+        with open(PD_PHONE_SYNC_PATH, "rb") as f:
+            return pickle.load(f)
+    except Exception as e:
+        print(f"⚠️ Ignoring unreadable pd_phone sync state: {e}")
+        return None
 
 def load_pd_phone_numbers():
-    pd_phone_numbers = {}
+    # Returns (phone -> deal entries, names of pd_phone sources that failed to load)
     folder_id = GDRIVE_FOLDERS["pd_phone"]
+    state = load_pd_phone_sync_state()
 
     try:
-        files = list_files_in_folder(folder_id)
+        try:
+            state = sync_pd_phone_state(state, folder_id)
+        except Exception as e:
+            if not state:
+                raise
+            # e.g. an expired page token; start over from a full listing
+            print(f"⚠️ pd_phone delta sync failed, doing a full sync: {e}")
+            state = sync_pd_phone_state(None, folder_id)
+        write_pickle_atomic(PD_PHONE_SYNC_PATH, state)
 
-        for file in files:
-            if not file["name"].endswith(".xlsx"):
-                continue
+    except Exception as e:
+        print(f"Error reading GDrive pd_phone folder: {e}")
+        return {}, ["pd_phone folder"]
+
+    failed = sorted(f"pd_phone/{state['files'][file_id]['name']}" for file_id in state["retry"])
+    return merge_pd_phone_index(state), failed
+
+class ReferenceLoader:
+    # Downloads pd_phone and every opt-out list concurrently in the background.
+    # Callers wait only for the parts they need; each opt-out list is merged into
+    # the shared phone -> bitmask index the first time a sheet needs it. Sources
+    # that fail to download are listed in failed_sources and never cached.
+    def __init__(self, opt_out_lists, cached=None):
+        self.opt_out_lists = opt_out_lists
+        self.from_cache = cached is not None
+        self.failed_sources = []
+        self.pool = None
+
+        if cached:
+            self.built_at = cached["built_at"]
+            self._pd_phone_numbers = cached["pd_phone_numbers"]
+            self._index = cached["opt_out_index"]
+            self._merged = (1 << len(opt_out_lists)) - 1
+        else:
+            self.built_at = time.time()
+            self._pd_phone_numbers = None
+            self._index = {}
+            self._merged = 0
+            self.pool = ThreadPoolExecutor(max_workers=1 + len(opt_out_lists))
+            self._pd_phone_future = self.pool.submit(load_pd_phone_numbers)
+            self._list_futures = [self.pool.submit(read_opt_out_list, name) for name in opt_out_lists]
+
+    def pd_phone_numbers(self):
+        if self._pd_phone_numbers is None:
+            self._pd_phone_numbers, failed = self._pd_phone_future.result()
+            self.failed_sources.extend(failed)
+        return self._pd_phone_numbers
+
+    def _opt_out_numbers(self, bit):
+        name = self.opt_out_lists[bit]
+        try:
+            return self._list_futures[bit].result()
+        except Exception as e:
+            print(f"⚠️ Error reading GDrive file {name}: {e}")
+            print(f"⚠️ Numbers in {name} are NOT being checked in this run")
+            self.failed_sources.append(name)
+            return set()
+
+    def opt_out_index(self, mask):
+        for bit in range(len(self.opt_out_lists)):
+            flag = 1 << bit
+            if mask & flag and not self._merged & flag:
+                index = self._index
+                for num in self._opt_out_numbers(bit):
+                    index[num] = index.get(num, 0) | flag
+                self._merged |= flag
+        return self._index
+
+    def opt_out_masks(self, numbers, mask):
+        # Opt-out list bits of every number as an int64 array. The lookup stays on
+        # the shared dict (building a pandas Index over millions of string keys
+        # costs seconds and isn't faster), but runs as one C-level map over the sheet.
+        index = self.opt_out_index(mask)
+        return np.fromiter(map(index.get, numbers, repeat(0)), dtype=np.int64, count=len(numbers))
+
+    def finish(self):
+        # Waits for every download and returns the data in reference cache form
+        opt_out_index = self.opt_out_index((1 << len(self.opt_out_lists)) - 1)
+        pd_phone_numbers = self.pd_phone_numbers()
+        return {
+            "built_at": self.built_at,
+            "opt_out_lists": self.opt_out_lists,
+            "opt_out_index": opt_out_index,
+            "pd_phone_numbers": pd_phone_numbers,
+            "failed_sources": list(self.failed_sources),
+        }
+
+    def save_cache(self):
+        if self.from_cache:
+            return
+        try:
+            save_reference_cache(self.finish())
+        except Exception as e:
+            print(f"⚠️ Could not save reference cache: {e}")
 
-            try:
-                content = download_file_by_id(file["id"])
-                df = pd.read_excel(content, engine="openpyxl", dtype=str)
-                df.fillna("", inplace=True)
-
-                for _, row in df.iterrows():
-                    deal_id = row.get("Deal - ID", "")
-                    deal_stage = row.get("Deal - Stage", "")
-
-                    for field in PHONE_FIELDS:
-                        raw_phones = str(row.get(field, ""))
-                        if not raw_phones.strip():
-                            continue
-
-                        for phone in map(str.strip, raw_phones.split(",")):
-                            normalized = normalize_phone(phone)
-                            if len(normalized) == 11 and normalized.startswith("1"):
-                                normalized = normalized[1:]
-                            if len(normalized) == 10 and normalized.isdigit():
-                                # Store as list to handle multiple deals
-                                pd_phone_numbers.setdefault(normalized, []).append({
-                                    "deal_id": deal_id,
-                                    "deal_stage": deal_stage
-                                })
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
 
-            except Exception as e:
-                print(f"Error reading file {file['name']}: {e}")
+def build_reference_data():
+    opt_out_lists, _, _ = compile_opt_out_rules(OPT_OUT_RULES)
+    loader = ReferenceLoader(opt_out_lists)
+    try:
+        return loader.finish()
+    finally:
+        loader.close()
+
+def write_pickle_atomic(path, obj):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+    # atomic swap so a run never reads a half-written cache
+    os.replace(tmp_path, path)
+
+def save_reference_cache(reference):
+    # Partial data would hide the missing numbers from every run until the cache
+    # expires, so an incomplete download is never cached
+    if reference["failed_sources"]:
+        print(f"⚠️ Reference data not cached; failed to load: {', '.join(reference['failed_sources'])}")
+        return False
+    write_pickle_atomic(REFERENCE_CACHE_PATH, reference)
+    return True
 
+def load_reference_cache(max_age=REFERENCE_MAX_AGE_SECONDS):
+    if not os.path.exists(REFERENCE_CACHE_PATH):
+        return None
+    try:
+        with open(REFERENCE_CACHE_PATH, "rb") as f:
+            reference = pickle.load(f)
     except Exception as e:
-        print(f"Error reading GDrive pd_phone folder: {e}")
-
-    return pd_phone_numbers
+        print(f"⚠️ Ignoring unreadable reference cache: {e}")
+        return None
+
+    opt_out_lists, _, _ = compile_opt_out_rules(OPT_OUT_RULES)
+    if time.time() - reference.get("built_at", 0) > max_age:
+        return None
+    if reference.get("failed_sources", ["unknown"]):
+        # incomplete, or written before failed sources were recorded
+        return None
+    if reference.get("opt_out_lists") != opt_out_lists:
+        # opt-out rules changed since the cache was built
+        return None
+    return reference
+
+def prefetch_reference_data():
+    # Downloads and indexes all reference data ahead of a run.
+    # Returns (build time, sources that failed to load); only complete data is cached.
+    reference = build_reference_data()
+    save_reference_cache(reference)
+    return reference["built_at"], reference["failed_sources"]
+
+def start_reference_loading(opt_out_lists, max_age=REFERENCE_MAX_AGE_SECONDS):
+    # Uses the prefetched cache when fresh, otherwise starts downloading in the background
+    return ReferenceLoader(opt_out_lists, cached=load_reference_cache(max_age))
 
 def extract_first_name(contact_person, deal_title):
     name = str(contact_person).strip()
@@ -227,247 +735,567 @@ def format_deal_county(deal_county):
     else:
         return f'"{", ".join(grouped[:-1])} and {grouped[-1]}"'
 
+# ------------------ INPUT ------------------
+def list_input_sheets(file_path):
+    # Sheet names in workbook order; CSV files have a single unnamed sheet
+    if file_path.lower().endswith(".csv"):
+        return [None]
+    with pd.ExcelFile(file_path, engine="openpyxl") as xls:
+        return xls.sheet_names
 
-# ------------------ MAIN SCRIPT ------------------
-
-def main():
-    seen_normalized_numbers = {}
-    pd_phone_numbers = load_pd_phone_numbers()
-    input_files = (
-        glob(os.path.join(INPUT_FOLDER, "*.xlsx")) +
-        glob(os.path.join(INPUT_FOLDER, "*.csv"))
-    )
+def read_input_sheet(file_path, sheet_name):
+    if sheet_name is None:
+        try:
+            return pd.read_csv(file_path, dtype=str, encoding="utf-8")
+        except UnicodeDecodeError:
+            return pd.read_csv(file_path, dtype=str, encoding="cp1252")  # aka Windows-1252
+    return pd.read_excel(file_path, sheet_name=sheet_name, engine="openpyxl", dtype=str)
+
+class InputReader:
+    # Parses input files ahead of row processing. A thread walks the files and
+    # submits one parse job per sheet to a process pool (openpyxl is CPU-bound);
+    # the bounded queue caps how many files are read ahead. Items come out in
+    # file order with sheets in workbook order, so duplicate precedence is unchanged.
+    def __init__(self, input_files, workers=INPUT_READER_WORKERS, queue_size=INPUT_QUEUE_SIZE):
+        self.input_files = input_files
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.stop = threading.Event()
+        self.pool = ProcessPoolExecutor(max_workers=workers) if input_files else None
+        self.thread = threading.Thread(target=self._produce, daemon=True)
+        self.thread.start()
+
+    def _produce(self):
+        for file_path in self.input_files:
+            try:
+                sheets = [
+                    (name, self.pool.submit(read_input_sheet, file_path, name))
+                    for name in list_input_sheets(file_path)
+                ]
+                item = (file_path, sheets, None)
+            except Exception as e:
+                item = (file_path, [], e)
+            if not self._put(item):
+                return
+        self._put(None)
 
-    cleaned_data = {}
-    
-    opt_out_cache = {}
+    def _put(self, item):
+        while not self.stop.is_set():
+            try:
+                self.queue.put(item, timeout=0.2)
+                return True
+            except queue.Full:
+                continue
+        return False
 
-    for file_path in tqdm(input_files, desc="Processing input files"):
+    def __iter__(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            yield item
+
+    def close(self):
+        # Normal end of a run: every parse has been consumed, so wait for the pool
+        # to wind down instead of leaving it to the interpreter's exit hook
+        self.stop.set()
+        if self.pool is not None:
+            self.pool.shutdown(wait=True)
+            self.pool = None
+
+    def abort(self):
+        # Cancel/error path: drop queued parses and don't wait on running ones
+        self.stop.set()
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
+
+def explode_phone_fields(df):
+    # Every phone of the sheet, one entry per comma-separated value, in row then
+    # PHONE_FIELDS order, normalized the same way as normalize_phone + the US
+    # country code strip. Returns (row positions, phones, normalized, valid).
+    fields = [field for field in PHONE_FIELDS if field in df.columns]
+    phones = (
+        df[fields].astype(str).reset_index(drop=True).stack()
+        .str.split(",").explode().str.strip()
+    )
+    phones = phones[phones != ""]
+    normalized = phones.str.replace(r"[^\d]", "", regex=True)
+    has_prefix = (normalized.str.len() == 11) & normalized.str.startswith("1")
+    normalized = normalized.where(~has_prefix, normalized.str[1:])
+    valid = (normalized.str.len() == 10) & normalized.str.isdigit()
+    rows = phones.index.get_level_values(0).to_numpy(dtype=np.int64)
+    return rows, phones, normalized, valid.to_numpy(dtype=bool)
+
+def clean_sheet(df, source_name, reference, compiled_rules, seen_numbers, on_chunk=None):
+    # Runs the opt-out, PD phone and duplicate checks over one input sheet.
+    # on_chunk(row_number) is called every PROGRESS_CHUNK_ROWS rows.
+    opt_out_lists, stage_masks, default_mask = compiled_rules
+
+    df.fillna("", inplace=True)
+    cleaned_rows = []
+    if df.empty:
+        return cleaned_rows
+
+    # Opt-out lists that apply to each row, resolved once per sheet
+    row_masks = df["Deal - Stage"].map(stage_masks).fillna(default_mask).astype("int64").to_numpy()
+
+    # Wait only for the reference data this sheet's stages actually use
+    needed_mask = 0
+    for mask in np.unique(row_masks):
+        needed_mask |= int(mask)
+
+    # one mask test: list bits of each phone & the lists that apply to its row
+    phone_rows, sheet_phones, sheet_normalized, sheet_valid = explode_phone_fields(df)
+    opt_out_hits = reference.opt_out_masks(sheet_normalized.to_numpy(dtype=object), needed_mask) & row_masks[phone_rows]
+    opt_out_hits[~sheet_valid] = 0
+
+    # phones of row n are entries row_starts[n] .. row_starts[n + 1] - 1
+    row_starts = np.searchsorted(phone_rows, np.arange(len(df) + 1)).tolist()
+    sheet_phones, sheet_normalized = sheet_phones.tolist(), sheet_normalized.tolist()
+    sheet_valid, opt_out_hits = sheet_valid.tolist(), opt_out_hits.tolist()
+    pd_phone_numbers = reference.pd_phone_numbers()
+
+    for row_number, (idx, row) in enumerate(tqdm(df.iterrows(), total=len(df), desc=f"Processing {source_name}", leave=False)):
+        if on_chunk and row_number % PROGRESS_CHUNK_ROWS == 0:
+            on_chunk(row_number)
         try:
-            if file_path.lower().endswith(".csv"):
-                try:
-                    df = pd.read_csv(file_path, dtype=str, encoding="utf-8")
-                except UnicodeDecodeError:
-                    df = pd.read_csv(file_path, dtype=str, encoding="cp1252")  # aka Windows-1252
-            else:
-                df = pd.read_excel(file_path, engine="openpyxl", dtype=str)
-            df = normalize_columns(df)
-            if not check_required_columns(df, file_path):
-                continue
-            df.fillna("", inplace=True)
-            cleaned_rows = []
-            
+            remarks = ""
+            deal_id = row.get("Deal - ID", "")
+            deal_stage = row.get("Deal - Stage", "")
+
+            contact_person = row.get("Deal - Contact person", "")
+            deal_title = row.get("Deal - Title", "")
+            first_name = extract_first_name(contact_person, deal_title)
+            deal_owner = row.get("Deal - Owner", "")
+            deal_owner_fn = extract_deal_owner(deal_owner)
+            raw_county = row.get("Deal - County", "")
+            formatted_county = format_deal_county(raw_county)
+
+            duplicates_found = {}
+            phone_to_use = ""
+            disallowed_found = False
+
+            opt_out_remarks = []
+            pd_phone_remarks = []
+            duplicate_remarks = []
+            format_remarks = []
+
+            # ------------------ STEP 1: OPT-OUT CHECK FIRST ------------------
+            opt_out_matches = defaultdict(list)
+            remaining_numbers = []
+
+            for i in range(row_starts[row_number], row_starts[row_number + 1]):
+                if not sheet_valid[i]:
+                    format_remarks.append(
+                        f"Phone number {sheet_phones[i]} has incorrect format even after normalization"
+                    )
+                    continue
 
-            for idx, row in tqdm(df.iterrows(), total=len(df), desc=f"Processing {os.path.basename(file_path)}", leave=False):
-                try:
-                    remarks = ""
-                    deal_id = row.get("Deal - ID", "")
-                    deal_stage = row.get("Deal - Stage", "")
-                    if deal_stage == "Cold Deals - Priority 2":
-                        key = "cold"
-                        excel_files_to_check = [
-                            "DNC (Cold-PD).xlsx",
-                            "CallOut-14d+TextOut-30d (Cold).xlsx"
-                        ]
-                    else:
-                        key = "normal"
-                        excel_files_to_check = [
-                            "DNC (Cold-PD).xlsx",
-                            "CallTextOut-7d (PD).xlsx"
-                        ]
-
-                    if key not in opt_out_cache:
-                        opt_out_cache[key] = load_opt_out_phone_numbers(excel_files_to_check)
-                        print(excel_files_to_check)
-
-                    gdrive_numbers = opt_out_cache[key]
-
-                    contact_person = row.get("Deal - Contact person", "")
-                    deal_title = row.get("Deal - Title", "")
-                    first_name = extract_first_name(contact_person, deal_title)
-                    deal_owner = row.get("Deal - Owner", "")
-                    deal_owner_fn = extract_deal_owner(deal_owner)
-                    raw_county = row.get("Deal - County", "")
-                    formatted_county = format_deal_county(raw_county)
-
-                    duplicates_found = {}
-                    phone_to_use = ""
-                    disallowed_found = False
-
-                    opt_out_remarks = []
-                    pd_phone_remarks = []
-                    duplicate_remarks = []
-                    format_remarks = []
-
-                    # ------------------ STEP 1: OPT-OUT CHECK FIRST ------------------
-                    opt_out_matches = defaultdict(list)
-                    remaining_numbers = []
-
-                    for field in PHONE_FIELDS:
-                        raw_phones = str(row.get(field, "")).strip()
-                        if not raw_phones:
-                            continue
-                        for phone in map(str.strip, raw_phones.split(",")):
-                            if not phone:   # ✅ skip blanks caused by ",,,"
-                                continue
-                            normalized = normalize_phone(phone)
-                            if len(normalized) == 11 and normalized.startswith("1"):
-                                normalized = normalized[1:]
-                            if not (len(normalized) == 10 and normalized.isdigit()):
-                                format_remarks.append(
-                                    f"Phone number {phone} has incorrect format even after normalization"
+                hits = opt_out_hits[i]
+                if hits:
+                    for bit, fname in enumerate(opt_out_lists):
+                        if hits >> bit & 1:
+                            opt_out_matches[fname].append(sheet_normalized[i])
+                else:
+                    remaining_numbers.append(sheet_normalized[i])
+
+            # Add opt-out remarks if any phones found in opt-out
+            if opt_out_matches:
+                # parts = []
+                for fname, nums in opt_out_matches.items():
+                    plural = "numbers" if len(nums) > 1 else "number"
+                    opt_out_remarks.append(f"Phone {plural} {', '.join(nums)} exist in {fname}")
+                remarks = "; ".join(opt_out_remarks)
+                # Don't set disallowed_found = True yet, because some phones remain
+
+
+            # ------------------ STEP 2: PD PHONE CHECK ------------------
+            if not disallowed_found and remaining_numbers:
+                pd_phone_remarks = set()
+
+                for normalized in remaining_numbers:
+                    if normalized in pd_phone_numbers:
+                        existing_entries = pd_phone_numbers[normalized]
+                        for entry in existing_entries:
+                            existing_deal = entry["deal_id"]
+                            existing_stage = entry["deal_stage"]
+                            current_stage = row.get("Deal - Stage", "")
+
+                            # Only block if stage is different
+                            if existing_stage != current_stage:
+                                pd_phone_remarks.add(
+                                    f"{normalized} exists in Deal ID {existing_deal} on stage {existing_stage} (PD Phone Numbers)"
                                 )
-                                continue
-
-                            if normalized in gdrive_numbers:
-                                for fname in gdrive_numbers[normalized]:
-                                    opt_out_matches[fname].append(normalized)
-                            else:
-                                remaining_numbers.append(normalized)
-
-                    # Add opt-out remarks if any phones found in opt-out
-                    if opt_out_matches:
-                        # parts = []
-                        for fname, nums in opt_out_matches.items():
-                            plural = "numbers" if len(nums) > 1 else "number"
-                            opt_out_remarks.append(f"Phone {plural} {', '.join(nums)} exist in {fname}")
-                        remarks = "; ".join(opt_out_remarks)
-                        # Don't set disallowed_found = True yet, because some phones remain
-
-
-                    # ------------------ STEP 2: PD PHONE CHECK ------------------
-                    if not disallowed_found and remaining_numbers:
-                        pd_phone_remarks = set()
-
-                        for normalized in remaining_numbers:
-                            if normalized in pd_phone_numbers:
-                                existing_entries = pd_phone_numbers[normalized]
-                                for entry in existing_entries:
-                                    existing_deal = entry["deal_id"]
-                                    existing_stage = entry["deal_stage"]
-                                    current_stage = row.get("Deal - Stage", "")
-
-                                    # Only block if stage is different
-                                    if existing_stage != current_stage:
-                                        pd_phone_remarks.add(
-                                            f"{normalized} exists in Deal ID {existing_deal} on stage {existing_stage} (PD Phone Numbers)"
-                                        )
-                                        disallowed_found = True
-
-                        # Combine remarks
-                        if pd_phone_remarks:
-                            if remarks:
-                                remarks += "; " + "; ".join(pd_phone_remarks)
-                            else:
-                                remarks = "; ".join(pd_phone_remarks)
-
-
-                        # If still no disallow, keep first unique number
-                        if not disallowed_found:
-                            for normalized in remaining_numbers:
-                                if normalized in seen_normalized_numbers:
-                                    first_deal = seen_normalized_numbers[normalized]
-                                    if first_deal != deal_id:
-                                        duplicates_found[normalized] = first_deal
-                                        duplicate_remarks.append(
-                                            f"Phone number {normalized} already exists in Deal ID {first_deal}"
-                                        )
-                                else:
-                                    seen_normalized_numbers[normalized] = deal_id
-
-                                    if not phone_to_use:
-                                        phone_to_use = normalized
-
-
-                    # ------------------ STEP 3: Remarks & Fallbacks ------------------                    
-                    remarks_list = []
-                    if format_remarks:
-                        remarks_list.append("; ".join(format_remarks))
-                    if opt_out_remarks:
-                        remarks_list.append("; ".join(opt_out_remarks))
-                    if pd_phone_remarks:
-                        remarks_list.append("; ".join(pd_phone_remarks))
-                    if duplicate_remarks:
-                        remarks_list.append("; ".join(duplicate_remarks))
-
-                    remarks = "; ".join(remarks_list)
-
-                    # ----- STEP 4: Final Cleaning to Retain Numbers with No Remarks -----
-                    non_formatting_remarks = [r for r in remarks_list if r not in format_remarks]
-                    # Apply final rules
-                    if not phone_to_use:
-                        # Case 1: No valid phone, keep all remarks
-                        remarks = "; ".join(remarks_list)  
-                    elif phone_to_use and not non_formatting_remarks:
-                        # Case 2: Valid phone exists and remarks only about formatting
-                        remarks = ""  # discard formatting-only remarks
-                    elif phone_to_use and non_formatting_remarks:
-                        # Case 4: Valid phone exists, but there are other critical issues (opt-out / duplicate)
-                        phone_to_use = ""  # remove all phones
-                        remarks = "; ".join(remarks_list)  # keep all remarks
+                                disallowed_found = True
+
+                # Combine remarks
+                if pd_phone_remarks:
+                    if remarks:
+                        remarks += "; " + "; ".join(pd_phone_remarks)
                     else:
-                        # Fallback (no remarks, no phone)
-                        remarks = ""
-
-                    # ------------------ STEP 5: Append to Cleaned Rows ------------------
-                    cleaned_rows.append({
-                            "Carrier": "",
-                            "Deal - ID": deal_id,
-                            "Phone Number": phone_to_use,
-                            "First Name": first_name,
-                            "Deal - Value": row.get("Deal - Value", ""),
-                            "Deal - Owner": deal_owner_fn,
-                            "Deal - County": formatted_county,
-                            "Deal - Title": row.get("Deal - Title", ""),
-                            "Deal - Stage": deal_stage,
-                            "Remarks": remarks
-                    })
+                        remarks = "; ".join(pd_phone_remarks)
+
+
+                # If still no disallow, keep first unique number
+                if not disallowed_found:
+                    for normalized in remaining_numbers:
+                        first_deal = seen_numbers.first_deal(normalized)
+                        if first_deal is not None:
+                            if first_deal != deal_id:
+                                duplicates_found[normalized] = first_deal
+                                duplicate_remarks.append(
+                                    f"Phone number {normalized} already exists in Deal ID {first_deal}"
+                                )
+                        else:
+                            seen_numbers.add(normalized, deal_id)
+
+                            if not phone_to_use:
+                                phone_to_use = normalized
+
+
+            # ------------------ STEP 3: Remarks & Fallbacks ------------------                    
+            remarks_list = []
+            if format_remarks:
+                remarks_list.append("; ".join(format_remarks))
+            if opt_out_remarks:
+                remarks_list.append("; ".join(opt_out_remarks))
+            if pd_phone_remarks:
+                remarks_list.append("; ".join(pd_phone_remarks))
+            if duplicate_remarks:
+                remarks_list.append("; ".join(duplicate_remarks))
+
+            remarks = "; ".join(remarks_list)
+
+            # ----- STEP 4: Final Cleaning to Retain Numbers with No Remarks -----
+            non_formatting_remarks = [r for r in remarks_list if r not in format_remarks]
+            # Apply final rules
+            if not phone_to_use:
+                # Case 1: No valid phone, keep all remarks
+                remarks = "; ".join(remarks_list)  
+            elif phone_to_use and not non_formatting_remarks:
+                # Case 2: Valid phone exists and remarks only about formatting
+                remarks = ""  # discard formatting-only remarks
+            elif phone_to_use and non_formatting_remarks:
+                # Case 4: Valid phone exists, but there are other critical issues (opt-out / duplicate)
+                phone_to_use = ""  # remove all phones
+                remarks = "; ".join(remarks_list)  # keep all remarks
+            else:
+                # Fallback (no remarks, no phone)
+                remarks = ""
+
+            # ------------------ STEP 5: Append to Cleaned Rows ------------------
+            # tuples in CLEANED_COLUMNS order; much lighter than a dict per row
+            cleaned_rows.append((
+                    "",
+                    deal_id,
+                    phone_to_use,
+                    first_name,
+                    row.get("Deal - Value", ""),
+                    deal_owner_fn,
+                    formatted_county,
+                    row.get("Deal - Title", ""),
+                    deal_stage,
+                    remarks
+            ))
+
+        except Exception as row_err:
+            print(f"⚠️ Skipping row {idx} in {source_name}: {row_err}")
+
+    return cleaned_rows
+
+# ------------------ OUTPUT ------------------
+def unique_sheet_name(base_name, used_names, suffix=""):
+    # Excel rejects []:*?/\ in sheet names and compares names case-insensitively
+    base = re.sub(r"[\[\]:*?/\\]", "_", str(base_name)).strip("'") or "Sheet"
+    suffix = re.sub(r"[\[\]:*?/\\]", "_", suffix)
+
+    def fit(tag):
+        # The base is shortened first so the suffix (input sheet, shard number) is
+        # kept; only a very long suffix is cut, leaving a few characters of the base
+        room = MAX_SHEET_NAME_LENGTH - len(tag)
+        kept_suffix = suffix[:room - min(len(base), 8)]
+        return base[:room - len(kept_suffix)] + kept_suffix + tag
+
+    name = fit("")
+    counter = 2
+    while name.lower() in used_names or name.lower() == "carrier":
+        name = fit(f"~{counter}")
+        counter += 1
+    used_names.add(name.lower())
+    return name
+
+def append_output_sheet(wb, sheet_name, df):
+    # Write-only mode streams rows to disk and sets the carrier formula in the same pass
+    ws = wb.create_sheet(sheet_name)
+    headers = list(df.columns)
+    ws.append(headers)
+
+    carrier_idx = headers.index("Carrier") if "Carrier" in headers else None
+    phone_letter = get_column_letter(headers.index("Phone Number") + 1) if "Phone Number" in headers else None
+
+    for row_idx, values in enumerate(df.itertuples(index=False, name=None), start=2):
+        values = list(values)
+        if carrier_idx is not None and phone_letter:
+            # Apply formula =VLOOKUP(C2,carrier!A:C,3,FALSE)
+            values[carrier_idx] = f"=VLOOKUP({phone_letter}{row_idx},carrier!A:C,3,FALSE)"
+        ws.append(values)
+
+def output_writer_process(jobs, results):
+    # Builds workbooks from ("sheet", path, name, df) jobs as they arrive and saves
+    # each on ("save", path). Reports exactly one result per workbook.
+    workbooks = {}
+    failed = {}
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+        action, output_path = job[0], job[1]
+        if action == "sheet":
+            if output_path in failed:
+                continue
+            try:
+                if output_path not in workbooks:
+                    workbooks[output_path] = Workbook(write_only=True)
+                append_output_sheet(workbooks[output_path], job[2], job[3])
+            except Exception as e:
+                workbooks.pop(output_path, None)
+                failed[output_path] = str(e)
+        else:
+            if output_path in failed:
+                results.put(("error", output_path, failed.pop(output_path)))
+                continue
+            try:
+                wb = workbooks.pop(output_path)
+                # Add empty 'carrier' sheet
+                wb.create_sheet("carrier")
+                wb.save(output_path)
+                results.put(("saved", output_path, None))
+            except Exception as e:
+                results.put(("error", output_path, str(e)))
+
+class ShardedOutputWriter:
+    # Streams cleaned sheets to writer processes while later files are still being
+    # processed. Sheets are split every MAX_ROWS_PER_SHEET rows and a new workbook is
+    # started every MAX_ROWS_PER_WORKBOOK rows; workbooks are spread across up to
+    # `workers` processes so several are written in parallel.
+    def __init__(self, date_str, workers=OUTPUT_WRITER_WORKERS):
+        self.date_str = date_str
+        self.base_name = f"{date_str}_pd_mktg_combined_output"
+        self.workers = workers
+        self.writers = []
+        self.results = None
+        self.used_names = set()
+        self.workbooks = []
+        self.workbook_rows = 0
+
+    def _path(self, number):
+        return os.path.join(OUTPUT_CLEANED_FOLDER, f"{self.base_name}_part{number:02d}.xlsx")
+
+    def _send(self, number, job):
+        self.writers[(number - 1) % len(self.writers)][1].put(job)
+
+    def _new_workbook(self):
+        if self.workbooks:
+            number = len(self.workbooks)
+            self._send(number, ("save", self._path(number)))
+
+        if self.results is None:
+            self.results = multiprocessing.Queue()
+        if len(self.writers) < self.workers:
+            jobs = multiprocessing.Queue(maxsize=OUTPUT_QUEUE_SIZE)
+            process = multiprocessing.Process(target=output_writer_process, args=(jobs, self.results), daemon=True)
+            process.start()
+            self.writers.append((process, jobs))
+
+        number = len(self.workbooks) + 1
+        self.workbooks.append({"file": os.path.basename(self._path(number)), "rows": 0, "sheets": []})
+        self.workbook_rows = 0
+
+    def add_sheet(self, base_name, df, source, suffix=""):
+        # suffix (e.g. " - <input sheet>") is kept whole when base_name is shortened
+        sheet_name = unique_sheet_name(base_name, self.used_names, suffix=suffix)
+        start = 0
+        part = 1
+        while start < len(df):
+            if not self.workbooks or self.workbook_rows >= MAX_ROWS_PER_WORKBOOK:
+                self._new_workbook()
+
+            stop = min(len(df), start + MAX_ROWS_PER_SHEET, start + MAX_ROWS_PER_WORKBOOK - self.workbook_rows)
+            if part == 1:
+                shard_name = sheet_name
+            else:
+                shard_name = unique_sheet_name(base_name, self.used_names, suffix=f"{suffix} ({part})")
+
+            number = len(self.workbooks)
+            self._send(number, ("sheet", self._path(number), shard_name, df.iloc[start:stop]))
+
+            workbook = self.workbooks[-1]
+            workbook["rows"] += stop - start
+            workbook["sheets"].append({
+                "sheet": shard_name,
+                "source_file": source.get("file", ""),
+                "input_sheet": source.get("sheet"),
+                "source_sheet": sheet_name,
+                "first_row": start + 1,
+                "last_row": stop,
+                "rows": stop - start,
+            })
+            self.workbook_rows += stop - start
+            start = stop
+            part += 1
+
+    def close(self):
+        # Saves the last workbook, waits for every writer and writes the manifest
+        if not self.workbooks:
+            return [], None
+
+        number = len(self.workbooks)
+        self._send(number, ("save", self._path(number)))
+        for _, jobs in self.writers:
+            jobs.put(None)
+
+        errors = []
+        pending = len(self.workbooks)
+        while pending:
+            try:
+                status, output_path, message = self.results.get(timeout=1)
+            except queue.Empty:
+                if any(not process.is_alive() and process.exitcode != 0 for process, _ in self.writers):
+                    raise RuntimeError("Output writer process exited unexpectedly")
+                continue
+            pending -= 1
+            if status == "error":
+                errors.append(f"{os.path.basename(output_path)}: {message}")
+
+        for process, _ in self.writers:
+            process.join()
+        self.writers = []
+
+        if errors:
+            raise RuntimeError("Failed to write output: " + "; ".join(errors))
+
+        output_files = [self._path(n) for n in range(1, len(self.workbooks) + 1)]
+        if len(output_files) == 1:
+            # a single workbook keeps the plain combined output name
+            single_path = os.path.join(OUTPUT_CLEANED_FOLDER, f"{self.base_name}.xlsx")
+            os.replace(output_files[0], single_path)
+            output_files = [single_path]
+            self.workbooks[0]["file"] = os.path.basename(single_path)
+
+        manifest_path = os.path.join(OUTPUT_CLEANED_FOLDER, f"{self.date_str}_pd_mktg_combined_manifest.json")
+        with open(manifest_path, "w") as f:
+            json.dump({"created": self.date_str, "workbooks": self.workbooks}, f, indent=2)
+
+        return output_files, manifest_path
+
+    def abort(self):
+        # Stops the writers and removes any partially written workbooks.
+        # Queue feeder threads may still be pushing a DataFrame into a pipe nobody
+        # reads any more; without cancel_join_thread() the interpreter would block
+        # on them at exit.
+        for process, jobs in self.writers:
+            jobs.cancel_join_thread()
+            jobs.close()
+            process.terminate()
+            process.join()
+        if self.results is not None:
+            self.results.cancel_join_thread()
+            self.results.close()
+        self.writers = []
+        for number in range(1, len(self.workbooks) + 1):
+            if os.path.exists(self._path(number)):
+                os.remove(self._path(number))
 
-                except Exception as row_err:
-                    print(f"⚠️ Skipping row {idx} in {os.path.basename(file_path)}: {row_err}")
 
+# ------------------ MAIN SCRIPT ------------------
 
-            if cleaned_rows:
-                cleaned_df = pd.DataFrame(cleaned_rows)
-                sheet_name = os.path.splitext(os.path.basename(file_path))[0][:31]
-                cleaned_data[sheet_name] = cleaned_df
+def main(progress=None, should_cancel=None):
+    # progress(fraction, message) is called at file and chunk boundaries;
+    # should_cancel() is polled at the same points and stops the run cleanly
+    def report(fraction, message):
+        if progress:
+            progress(fraction, message)
 
-        except Exception as e:
-            print(f"Error processing {file_path}: {e}")
+    def check_cancel():
+        if should_cancel and should_cancel():
+            raise RunCancelled("Run cancelled")
 
- # ------------- COMBINE INTO ONE EXCEL FILE -------------
-    if cleaned_data:
-        date_str = datetime.now().strftime("%Y%m%d_%H%M%S")
-        combined_output = os.path.join(OUTPUT_CLEANED_FOLDER, f"{date_str}_pd_mktg_combined_output.xlsx")
+    # sorted so file order (and therefore duplicate precedence) is the same every run
+    input_files = (
+        sorted(glob(os.path.join(INPUT_FOLDER, "*.xlsx"))) +
+        sorted(glob(os.path.join(INPUT_FOLDER, "*.csv")))
+    )
+    compiled_rules = compile_opt_out_rules(OPT_OUT_RULES)
 
-        with pd.ExcelWriter(combined_output, engine="openpyxl") as writer:
-            for sheet_name, df in cleaned_data.items():
-                df.to_excel(writer, sheet_name=sheet_name, index=False)
+    # Pipeline: reference downloads, input parsing, row processing and output writing
+    # all run at the same time; each stage only waits on the data it needs.
+    report(0.0, "Loading reference data")
+    reference = start_reference_loading(compiled_rules[0])
+    reader = InputReader(input_files)
+    writer = ShardedOutputWriter(datetime.now().strftime("%Y%m%d_%H%M%S"))
+    seen_numbers = PhoneDedupIndex()
 
-            # Add empty 'carrier' sheet
-            empty_df = pd.DataFrame()
-            empty_df.to_excel(writer, sheet_name="carrier", index=False)
+    try:
+        for file_number, (file_path, sheets, read_error) in enumerate(
+            tqdm(reader, total=len(input_files), desc="Processing input files")
+        ):
+            check_cancel()
+            file_name = os.path.basename(file_path)
+            file_label = f"{file_name} ({file_number + 1}/{len(input_files)})"
+            report(file_number / len(input_files), f"Reading {file_label}")
+            if read_error is not None:
+                print(f"Error processing {file_path}: {read_error}")
+                continue
 
-        # ------------- ADD FORMULAS USING OPENPYXL -------------
-        wb = load_workbook(combined_output)
-        for sheet_name in cleaned_data.keys():
-            ws = wb[sheet_name]
+            # Sheets are cleaned in workbook order so first-seen duplicates stay deterministic
+            for sheet_number, (input_sheet, sheet_future) in enumerate(sheets):
+                source_name = file_name if input_sheet is None else f"{file_name} [{input_sheet}]"
 
-            # Find column index for "Carrier" and "Phone Number"
-            headers = [cell.value for cell in ws[1]]
-            try:
-                carrier_col = headers.index("Carrier") + 1
-                phone_col = headers.index("Phone Number") + 1
-            except ValueError:
-                continue  # skip if missing
+                def on_chunk(row_number):
+                    check_cancel()
+                    done = file_number + (sheet_number + row_number / max(len(df), 1)) / len(sheets)
+                    report(done / len(input_files), f"Processing {file_label}")
 
-            # Apply formula =VLOOKUP(C2,carrier!A:C,3,FALSE)
-            for row_idx in range(2, ws.max_row + 1):
-                formula = f'=VLOOKUP({get_column_letter(phone_col)}{row_idx},carrier!A:C,3,FALSE)'
-                ws.cell(row=row_idx, column=carrier_col).value = formula
+                try:
+                    df = normalize_columns(sheet_future.result())
+                    if not check_required_columns(df, source_name):
+                        continue
+
+                    cleaned_rows = clean_sheet(df, source_name, reference, compiled_rules, seen_numbers, on_chunk)
+
+                    if cleaned_rows:
+                        cleaned_df = pd.DataFrame.from_records(cleaned_rows, columns=CLEANED_COLUMNS)
+                        base_name = os.path.splitext(file_name)[0]
+                        sheet_suffix = f" - {input_sheet}" if len(sheets) > 1 else ""
+                        # handed to the writer now; later files keep processing meanwhile
+                        writer.add_sheet(base_name, cleaned_df, {"file": file_name, "sheet": input_sheet}, sheet_suffix)
+
+                except RunCancelled:
+                    raise
+                except Exception as e:
+                    print(f"Error processing {source_name}: {e}")
+
+        seen_numbers.close()
+        check_cancel()
+
+        # ------------- FINISH SHARDED EXCEL FILES -------------
+        report(1.0, "Writing output")
+        output_files, manifest_path = writer.close()
+        for output_file in output_files:
+            print(f"\n✅ Combined cleaned file saved to: {output_file}")
+        if manifest_path:
+            print(f"📄 Output manifest saved to: {manifest_path}")
+
+        reference.save_cache()
+
+    except BaseException:
+        writer.abort()
+        reader.abort()
+        raise
+    finally:
+        reader.close()
+        reference.close()
+        seen_numbers.close()
 
-        wb.save(combined_output)
-        print(f"\n✅ Combined cleaned file saved to: {combined_output}")
-    
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
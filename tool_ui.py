@@ -1,16 +1,65 @@
 import os
 import sys
-import threading
+import multiprocessing
 import subprocess
 import io
+from datetime import datetime
 import customtkinter as ctk
 import tkinter as tk 
 from tkinter import messagebox
-from pd_marketing_cleaning_tool import main as cleaning_main
 
 ctk.set_appearance_mode("dark")  # "dark" or "light"
 ctk.set_default_color_theme("dark-blue")  # optional theme
 
+# how often reference data is re-downloaded while the app is open
+REFERENCE_REFRESH_MS = 10 * 60 * 1000
+# how long a finished worker gets to exit on its own before it is terminated
+WORKER_EXIT_GRACE_MS = 10 * 1000
+
+
+def run_prefetch_worker(conn):
+    # Downloads and indexes reference data into the on-disk cache used by runs
+    if sys.stdout is None:
+        sys.stdout = io.StringIO()
+    if sys.stderr is None:
+        sys.stderr = io.StringIO()
+
+    try:
+        from pd_marketing_cleaning_tool import prefetch_reference_data
+        built_at, failed_sources = prefetch_reference_data()
+        if failed_sources:
+            conn.send(("incomplete", failed_sources))
+        else:
+            conn.send(("ready", built_at))
+    except Exception as e:
+        conn.send(("error", str(e)))
+    finally:
+        conn.close()
+
+
+def run_cleaning_worker(conn, cancel_event):
+    # Runs in a separate process so the GUI stays responsive and all run memory
+    # is released when the process exits. Progress is streamed back over the pipe.
+    if sys.stdout is None:
+        sys.stdout = io.StringIO()
+    if sys.stderr is None:
+        sys.stderr = io.StringIO()
+
+    from pd_marketing_cleaning_tool import main as cleaning_main, RunCancelled
+
+    try:
+        cleaning_main(
+            progress=lambda fraction, message: conn.send(("progress", fraction, message)),
+            should_cancel=cancel_event.is_set,
+        )
+        conn.send(("done",))
+    except RunCancelled:
+        conn.send(("cancelled",))
+    except Exception as e:
+        conn.send(("error", str(e)))
+    finally:
+        conn.close()
+
 class MinimalToolUI(ctk.CTk):
     def __init__(self):
         super().__init__()
@@ -39,7 +88,14 @@ class MinimalToolUI(ctk.CTk):
                                               text=f"Input folder: {self.input_folder}",
                                               text_color="#BBB8A6",
                                               font=ctk.CTkFont(family="Segoe UI", size=12))
-        self.input_folder_label.pack(pady=(0, 15))
+        self.input_folder_label.pack(pady=(0, 5))
+
+        # Reference data (pd_phone + opt-out lists) status
+        self.reference_label = ctk.CTkLabel(self,
+                                            text="Reference data: not loaded",
+                                            text_color="#BBB8A6",
+                                            font=ctk.CTkFont(family="Segoe UI", size=12))
+        self.reference_label.pack(pady=(0, 15))
 
         # Button frame
         btn_frame = ctk.CTkFrame(self, fg_color="#273946", corner_radius=0)
@@ -107,7 +163,13 @@ class MinimalToolUI(ctk.CTk):
                                      command=self.run_tool)
         self.run_btn.pack(pady=15)
 
+        self.worker = None
+        self.prefetch = None
+        self.pending_run = False
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+
         self.load_file_list()
+        self.start_prefetch()
 
     def open_input_folder(self):
         folder = self.input_folder
@@ -165,22 +227,192 @@ class MinimalToolUI(ctk.CTk):
         self.run_btn.configure(state="disabled")
         self.animate_dots()
         self.show_wait_popup()
-        threading.Thread(target=self.run_main_process, daemon=True).start()
+        if self.prefetch is not None:
+            # reference data is still downloading; the run starts as soon as it is cached
+            self.pending_run = True
+            self.wait_status_label.configure(text="Waiting for reference data")
+        else:
+            self.start_worker()
+
+    def start_prefetch(self):
+        # Never refresh the cache underneath a running job; try again later
+        if self.prefetch is not None or self.worker is not None:
+            self.after(REFERENCE_REFRESH_MS, self.start_prefetch)
+            return
+        self.reference_label.configure(text="Reference data: loading...")
+        self.prefetch_conn, child_conn = multiprocessing.Pipe(duplex=False)
+        self.prefetch = multiprocessing.Process(target=run_prefetch_worker, args=(child_conn,), daemon=True)
+        self.prefetch.start()
+        child_conn.close()
+        self.after(500, self.poll_prefetch)
+
+    def poll_prefetch(self):
+        result = None
+        try:
+            if self.prefetch_conn.poll():
+                result = self.prefetch_conn.recv()
+            elif not self.prefetch.is_alive():
+                # the child may have sent its result and exited after the first poll
+                if self.prefetch_conn.poll():
+                    result = self.prefetch_conn.recv()
+                else:
+                    result = ("error", "Prefetch process exited unexpectedly")
+        except EOFError:
+            result = ("error", "Prefetch process exited unexpectedly")
+
+        if result is None:
+            self.after(500, self.poll_prefetch)
+            return
+
+        self.reap_worker(self.prefetch, WORKER_EXIT_GRACE_MS)
+        self.prefetch_conn.close()
+        self.prefetch = None
+        self.prefetch_conn = None
+
+        if result[0] == "ready":
+            updated = datetime.fromtimestamp(result[1]).strftime("%H:%M")
+            self.reference_label.configure(text=f"Reference data: ready (updated {updated})")
+        elif result[0] == "incomplete":
+            # incomplete data is not cached, so a run won't reuse it
+            self.reference_label.configure(text=f"Reference data: incomplete, failed to load {', '.join(result[1])}")
+        else:
+            # the run falls back to downloading the data itself
+            self.reference_label.configure(text=f"Reference data: refresh failed ({result[1]})")
+
+        if self.pending_run:
+            self.pending_run = False
+            self.start_worker()
+
+        self.after(REFERENCE_REFRESH_MS, self.start_prefetch)
+
+    def start_worker(self):
+        self.worker_conn, child_conn = multiprocessing.Pipe(duplex=False)
+        self.cancel_event = multiprocessing.Event()
+        # not a daemon: the run starts its own output writer processes
+        self.worker = multiprocessing.Process(target=run_cleaning_worker,
+                                              args=(child_conn, self.cancel_event))
+        self.worker.start()
+        child_conn.close()
+        self.after(100, self.poll_worker)
+
+    def cancel_run(self):
+        if self.pending_run:
+            # still waiting on the prefetch; nothing has started, so just back out
+            self.pending_run = False
+            self.dots_running = False
+            self.close_wait_popup()
+            self.run_btn.configure(state="normal")
+            self.update_message("Run cancelled before it started.")
+            return
+        if getattr(self, "cancel_event", None) is not None and not self.cancel_event.is_set():
+            self.cancel_event.set()
+            self.cancel_btn.configure(state="disabled", text="Cancelling...")
+
+    def poll_worker(self):
+        # Drain everything the worker has sent so far; widgets are only touched here
+        result = None
+        try:
+            while self.worker_conn.poll():
+                msg = self.worker_conn.recv()
+                if msg[0] == "progress":
+                    _, fraction, text = msg
+                    self.progress.set(fraction)
+                    if hasattr(self, "wait_status_label"):
+                        self.wait_status_label.configure(text=text)
+                else:
+                    result = msg
+                    break
+        except EOFError:
+            result = ("error", "Worker process exited unexpectedly")
+
+        if result is None and not self.worker.is_alive() and not self.worker_conn.poll():
+            result = ("error", "Worker process exited unexpectedly")
+
+        if result is None:
+            self.after(100, self.poll_worker)
+            return
+
+        self.finish_worker()
+        self.dots_running = False
+        self.close_wait_popup()
+        self.run_btn.configure(state="normal")
+
+        if result[0] == "done":
+            self.update_message("Processing finished successfully!")
+            self.progress.set(1.0)
+
+            def ask_open_folder():
+                if messagebox.askyesno("Done", "Processing finished!\nOpen output folder?"):
+                    output_folder = os.path.abspath("output")
+                    if not os.path.exists(output_folder):
+                        os.makedirs(output_folder)
+                    self.open_folder(output_folder)
+            self.message_label.after(0, ask_open_folder)
+        elif result[0] == "cancelled":
+            self.progress.set(0)
+            self.update_message("Run cancelled. No output was written.")
+        else:
+            self.update_message(f"Failed to run tool:\n{result[1]}")
+
+    def finish_worker(self):
+        # The worker has reported its result; let it exit in the background so the
+        # UI never blocks on join()
+        worker = self.worker
+        self.worker_conn.close()
+        self.worker = None
+        self.worker_conn = None
+        self.cancel_event = None
+        self.reap_worker(worker, WORKER_EXIT_GRACE_MS)
+
+    def reap_worker(self, worker, remaining_ms):
+        if not worker.is_alive():
+            worker.join()
+            return
+        if remaining_ms is not None and remaining_ms <= 0:
+            worker.terminate()
+            remaining_ms = None  # terminated; keep polling until it is gone
+        self.after(200, self.reap_worker, worker, None if remaining_ms is None else remaining_ms - 200)
+
+    def on_close(self):
+        if getattr(self, "prefetch", None) is not None and self.prefetch.is_alive():
+            self.prefetch.terminate()
+        if getattr(self, "worker", None) is not None and self.worker.is_alive():
+            self.cancel_event.set()
+            self.worker.join(timeout=5)
+            if self.worker.is_alive():
+                self.worker.terminate()
+        self.destroy()
 
     def show_wait_popup(self):
         # Create a top-level window
         self.wait_popup = ctk.CTkToplevel(self)
         self.wait_popup.title("Please Wait")
-        self.wait_popup.geometry("300x100")
+        self.wait_popup.geometry("320x160")
         self.wait_popup.resizable(False, False)
         self.wait_popup.transient(self)  # stay on top of parent
         self.wait_popup.grab_set()       # block interaction with main window
+        self.wait_popup.protocol("WM_DELETE_WINDOW", self.cancel_run)
 
         # Center text label
         self.wait_label = ctk.CTkLabel(self.wait_popup,
                                        text="Processing",
                                        font=ctk.CTkFont(family="Segoe UI", size=14))
-        self.wait_label.pack(expand=True, pady=20)
+        self.wait_label.pack(pady=(20, 5))
+
+        # Current stage reported by the worker
+        self.wait_status_label = ctk.CTkLabel(self.wait_popup,
+                                              text="",
+                                              text_color="#BBB8A6",
+                                              wraplength=280,
+                                              font=ctk.CTkFont(family="Segoe UI", size=11))
+        self.wait_status_label.pack(pady=(0, 5))
+
+        self.cancel_btn = ctk.CTkButton(self.wait_popup, text="Cancel",
+                                        width=100,
+                                        fg_color="#CB1F47",
+                                        hover_color="#ffab4c",
+                                        command=self.cancel_run)
+        self.cancel_btn.pack(pady=(5, 15))
 
         # Animation control
         self.wait_dots_running = True
@@ -199,6 +431,8 @@ class MinimalToolUI(ctk.CTk):
         if hasattr(self, "wait_popup"):
             self.wait_dots_running = False
             self.wait_popup.destroy()
+            del self.wait_popup
+            del self.wait_status_label
 
     def animate_dots(self):
             if not self.dots_running:
@@ -209,37 +443,12 @@ class MinimalToolUI(ctk.CTk):
             self.message_label.configure(text=base_text + dots)
             self.message_label.after(500, self.animate_dots)
 
-    def run_main_process(self):
-        try:
-            if sys.stdout is None:
-                sys.stdout = io.StringIO()
-            if sys.stderr is None:
-                sys.stderr = io.StringIO()
-
-            cleaning_main()
-            self.dots_running = False
-            self.close_wait_popup() 
-            self.run_btn.configure(state="normal")
-            self.update_message("Processing finished successfully!")
-            self.progress.set(1.0)
-
-            def ask_open_folder():
-                if messagebox.askyesno("Done", "Processing finished!\nOpen output folder?"):
-                    output_folder = os.path.abspath("output")
-                    if not os.path.exists(output_folder):
-                        os.makedirs(output_folder)
-                    self.open_folder(output_folder)
-            self.message_label.after(0, ask_open_folder)
-
-        except Exception as e:
-            self.close_wait_popup()
-            self.run_btn.configure(state="normal")
-            self.update_message(f"Failed to run tool:\n{e}")
-
     def update_message(self, text):
         self.message_label.after(0, lambda: self.message_label.configure(text=text))
 
 
 if __name__ == "__main__":
+    # required so the frozen exe can start output writer processes
+    multiprocessing.freeze_support()
     app = MinimalToolUI()
     app.mainloop()